@@ -5,22 +5,39 @@ A Bowtie harness for the json-schema-utils schema validator
 using the dynamic json-model-compiler Python backend.
 """
 
-from dataclasses import dataclass
+from collections import OrderedDict
+from collections.abc import Callable
 from importlib import metadata
 from pathlib import Path
+import atexit
+import functools
 import hashlib
 import json
+import operator
+import os
 import platform
 import shutil
 import sys
+import tempfile
 import traceback
 
 from jsonschema_specifications import REGISTRY
 from jsutils import json_schema_to_python_checker
 
+try:
+    import orjson
+except ImportError:  # fall back on the standard library
+    orjson = None
+
+try:
+    import xxhash
+except ImportError:  # fall back on the standard library
+    xxhash = None
+
 type JsonObject = dict[str, Json]
 type JsonArray = list[Json]
 type Json = None | bool | int | float | str | JsonArray | JsonObject
+type Checker = Callable[[Json], bool]
 
 # available JSON Schema specifications
 SPECS: dict[str, JsonObject] = {
@@ -37,8 +54,18 @@ VERSIONS: dict[str, int] = {
     "http://json-schema.org/draft-03/schema#": 3,
 }
 
-# cache is used for registry and meta schemas
-CACHE: Path = Path(__file__).parent / "schema-cache-by-hashed-urls"
+# RAM-backed private cache is used for registry and meta schemas
+# only the parent of a private mkdtemp directory, which is mode 0700
+SHM: Path = Path("/dev/shm")  # noqa: S108
+CACHE: Path = Path(
+    tempfile.mkdtemp(prefix="jsu-cache-", dir=SHM if SHM.is_dir() else None),
+)
+
+# digests of registry schemas currently in cache, by url
+MATERIALIZED: dict[str, bytes] = {}
+
+# maximum number of compiled checkers kept by a runner
+CHECKERS: int = 512
 
 # version for both front-end and back-end
 JSU_VERSION: str = (
@@ -46,40 +73,141 @@ JSU_VERSION: str = (
     f" (backend jmc {metadata.version('json_model_compiler')})"
 )
 
+# implementation meta data, which do not change while running
+IMPLEMENTATION: JsonObject = {
+    "language": "python",
+    "language_version": platform.python_version(),
+    "name": "jsu",
+    "version": JSU_VERSION,
+    "homepage": "https://github.com/zx80/json-schema-utils/",
+    "documentation": "https://github.com/zx80/json-schema-utils/",
+    "issues": "https://github.com/zx80/json-schema-utils/issues",
+    "source": "https://github.com/zx80/json-schema-utils.git",
+    "dialects": sorted(VERSIONS.keys()),
+    "os": platform.system(),
+    "os_version": platform.release(),
+}
+
+# response to start, shared as it is serialized and never modified
+START_RESPONSE: JsonObject = {"version": 1, "implementation": IMPLEMENTATION}
+
+
+@functools.cache
+def url_hash(url: str) -> str:
+    """Cache file name for an url, must match the jsutils resolver naming."""
+    return hashlib.sha3_256(url.encode()).hexdigest()[:16]
+
+
+def json_bytes(data: Json, sort: bool = False) -> bytes:
+    """Serialize compact json data, with orjson if available."""
+    if orjson is not None:
+        option = orjson.OPT_SORT_KEYS if sort else 0
+        try:
+            return orjson.dumps(data, option=option)
+        except TypeError:  # integers beyond 64 bits
+            pass
+    return json.dumps(data, sort_keys=sort, separators=(",", ":")).encode()
+
+
+def digest(payload: bytes) -> bytes:
+    """Compute a 128-bit non-cryptographic digest, with xxhash if available."""
+    if xxhash is not None:
+        return xxhash.xxh3_128_digest(payload)
+    return hashlib.blake2b(payload, digest_size=16).digest()
+
+
+def send(payload: bytes):
+    """Write a response directly to stdout, without python buffering."""
+    view = memoryview(payload)
+    while view:
+        view = view[os.write(1, view) :]
+
+
+def write_schema(url: str, payload: bytes):
+    """Put a serialized schema in cache under its hashed url."""
+    path = CACHE / f"{url_hash(url)}.json"
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.write(fd, payload)
+    finally:
+        os.close(fd)
+
+
+def materialize_specs():
+    """Put meta schemas in cache once, as they never change."""
+    atexit.register(shutil.rmtree, CACHE, ignore_errors=True)
+    for url, schema in SPECS.items():
+        write_schema(url, json_bytes(schema))
+
+
+def materialize_registry(registry: JsonObject | None):
+    """Put a case registry in cache, skipping schemas already there."""
+
+    registry = registry or {}
+
+    # wipe out entries from previous registries to avoid state leaks
+    for url in [url for url in MATERIALIZED if url not in registry]:
+        del MATERIALIZED[url]
+        if url in SPECS:  # restore overridden meta schema
+            write_schema(url, json_bytes(SPECS[url]))
+        else:
+            (CACHE / f"{url_hash(url)}.json").unlink(missing_ok=True)
+
+    for url, schema in registry.items():
+        payload = json_bytes(schema)
+        pdigest = digest(payload)
+        if MATERIALIZED.get(url) != pdigest:
+            write_schema(url, payload)
+            MATERIALIZED[url] = pdigest
+
+
+materialize_specs()
+
 
 class RunnerError(Exception):
     pass
 
 
-@dataclass
 class Runner:
-    # current dialect
-    version: int | None = None
+    __slots__ = ("_checker_cache", "_compiler", "_dispatch", "line", "version")
+
+    def __init__(self):
+        # current dialect
+        self.version: int | None = None
+
+        # schema compiler specialized for the current dialect
+        self._specialize()
+
+        # count input lines for some error messages
+        self.line: int = 0
+
+        # compiled checkers by hashed dialect, schema and registry, LRU order
+        self._checker_cache: OrderedDict[bytes, Checker] = OrderedDict()
+
+        # command handlers
+        self._dispatch: dict[str, Callable[[JsonObject], JsonObject]] = {
+            "start": self.cmd_start,
+            "dialect": self.cmd_dialect,
+            "run": self.cmd_run,
+            "stop": self.cmd_stop,
+        }
 
-    # count input lines for some error messages
-    line: int = 0
+    def _specialize(self):
+        """Bind the schema compiler to the current dialect."""
+        self._compiler: Callable[[Json, str | None], Checker] = (
+            functools.partial(
+                json_schema_to_python_checker,
+                cache=CACHE,
+                version=self.version,
+            )
+        )
 
     def cmd_start(self, req: JsonObject) -> JsonObject:
         """Respond to start with various meta data about the implementation."""
 
         assert req.get("version") == 1, "expecting protocol version 1"
 
-        return {
-            "version": 1,
-            "implementation": {
-                "language": "python",
-                "language_version": platform.python_version(),
-                "name": "jsu",
-                "version": JSU_VERSION,
-                "homepage": "https://github.com/zx80/json-schema-utils/",
-                "documentation": "https://github.com/zx80/json-schema-utils/",
-                "issues": "https://github.com/zx80/json-schema-utils/issues",
-                "source": "https://github.com/zx80/json-schema-utils.git",
-                "dialects": sorted(VERSIONS.keys()),
-                "os": platform.system(),
-                "os_version": platform.release(),
-            },
-        }
+        return START_RESPONSE
 
     def cmd_dialect(self, req: JsonObject) -> JsonObject:
         """Set current JSON Schema dialect, needed for schema semantics."""
@@ -91,6 +219,8 @@ class Runner:
         except KeyError:  # unknown version
             self.version = 0
 
+        self._specialize()
+
         return {"ok": True}
 
     def cmd_run(self, req: JsonObject) -> JsonObject:
@@ -105,29 +235,19 @@ class Runner:
         description = case.get("description")
         assert description is None or isinstance(description, str)
 
-        CACHE.mkdir(exist_ok=True)
+        registry = case.get("registry")
+        assert registry is None or isinstance(registry, dict)
+
         results: JsonArray = []
 
         try:
-            # put registries in cache
-            for reg in [SPECS, case.get("registry")]:
-                if reg is not None:
-                    for url, schema in reg.items():
-                        # use truncated hashed url as filename
-                        uh = hashlib.sha3_256(url.encode()).hexdigest()[:16]
-                        with Path.open(CACHE / f"{uh}.json", "w") as fp:
-                            json.dump(schema, fp)
-
-            # compile schema to python
-            checker = json_schema_to_python_checker(
-                jschema,
-                description,
-                cache=CACHE,
-                version=self.version,
-            )
+            # identical schemas are often sent again, so reuse their checker
+            checker = self.checker(jschema, description, registry)
 
-            # apply to test vector
-            results = [{"valid": checker(test["instance"])} for test in tests]
+            # apply to test vector, sequentially: generated checkers cannot
+            # be pickled, and a check costs far less than inter-process calls
+            instances = map(operator.itemgetter("instance"), tests)
+            results = [{"valid": valid} for valid in map(checker, instances)]
 
         except Exception:  # an internal error occurred
             return {
@@ -136,14 +256,50 @@ class Runner:
                 "context": {"traceback": traceback.format_exc()},
             }
 
-        finally:  # wipe out cache to avoid state leaks
-            shutil.rmtree(CACHE)
-
         return {
             "seq": req["seq"],
             "results": results,
         }
 
+    def checker(
+        self,
+        jschema: Json,
+        description: str | None,
+        registry: JsonObject | None,
+    ) -> Checker:
+        """Get a compiled checker, from the cache if possible."""
+
+        # the description is only used for naming, it does not change semantics
+        key = digest(json_bytes([self.version, jschema, registry], sort=True))
+
+        if key in self._checker_cache:
+            self._checker_cache.move_to_end(key)
+            return self._checker_cache[key]
+
+        checker = self.compile(jschema, description, registry)
+
+        self._checker_cache[key] = checker
+        if len(self._checker_cache) > CHECKERS:
+            self._checker_cache.popitem(last=False)
+
+        return checker
+
+    def compile(
+        self,
+        jschema: Json,
+        description: str | None,
+        registry: JsonObject | None,
+    ) -> Checker:
+        """Compile a schema with its registry to a python checker."""
+
+        # put registry in cache, meta schemas are already there;
+        # jsutils only resolves urls through its own resolver, which reads
+        # hashed url files from the cache, there is no in-memory hook
+        materialize_registry(registry)
+
+        # compile schema to python
+        return self._compiler(jschema, description)
+
     def cmd_stop(self, req: JsonObject) -> JsonObject:
         """Stop all processing."""
         sys.exit(0)
@@ -152,23 +308,18 @@ class Runner:
         """Process one request."""
 
         cmd = req["cmd"]
-        match cmd:
-            case "start":
-                return self.cmd_start(req)
-            case "dialect":
-                return self.cmd_dialect(req)
-            case "run":
-                return self.cmd_run(req)
-            case "stop":
-                return self.cmd_stop(req)
-            case _:  # trigger crash
-                raise RunnerError(f"unexpected bowtie command cmd={cmd}")
+        handler = self._dispatch.get(cmd)
+        if handler is None:  # trigger crash
+            raise RunnerError(f"unexpected bowtie command cmd={cmd}")
+        return handler(req)
 
     def run(self):
         """Runner purpose is to run."""
 
-        # request/response protocol is to receive and send one-line jsons
-        for line in sys.stdin:
+        # request/response protocol is to receive and send one-line jsons,
+        # read as bytes which json parses without an intermediate string
+        readline = sys.stdin.buffer.readline
+        while line := readline():
             self.line += 1
             try:
                 req = json.loads(line)
@@ -178,9 +329,8 @@ class Runner:
                 sys.stderr.write(f"{self.line}: invalid json input ({e})\n")
                 sys.stderr.flush()
                 raise  # voluntary crash
-            sys.stdout.write(json.dumps(res))
-            sys.stdout.write("\n")
-            sys.stdout.flush()
+            # bowtie waits for each response before sending the next request
+            send(json_bytes(res) + b"\n")
 
 
 if __name__ == "__main__":